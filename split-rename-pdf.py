@@ -1,6 +1,17 @@
+from __future__ import annotations
+
+import importlib.metadata
+import importlib.util
+import io
+import os
+import shutil
 import sys
 import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional
 import re
 
 # ---------------------------------------------------------------------
@@ -8,13 +19,34 @@ import re
 # ---------------------------------------------------------------------
 BASE_DIR = Path(__file__).parent.resolve()
 EXCEL_FILENAME = BASE_DIR / "rename-pdf-mapping.xlsx"
-OUTPUT_PATTERN = "{yearbook}_{category}_{year}_{first_page}_{last_page}_{product}"
+CSV_FILENAME = BASE_DIR / "rename-pdf-mapping.csv"
 REQUIRED_COLUMNS = [
     "yearbook", "year", "category", "products",
     "yearbook_start", "yearbook_end", "pdf_start", "pdf_end"
 ]
+COLUMN_DTYPES = {
+    "yearbook": "string",
+    "year": "string",
+    "category": "string",
+    "products": "string",
+    "yearbook_start": "Int64",
+    "yearbook_end": "Int64",
+    "pdf_start": "Int64",
+    "pdf_end": "Int64",
+}
 FIELDS_TO_SANITIZE = ["yearbook", "year", "category", "products"]
-REQUIRED_PACKAGES = ["pandas", "PyPDF2", "openpyxl"]
+PAGE_COLUMNS = ["yearbook_start", "yearbook_end", "pdf_start", "pdf_end"]
+SANITIZE_PATTERN = re.compile(r'[\/:*?"<>|\s]+')
+EXCEL_ENGINE = "calamine"
+PROGRESS_INTERVAL = 1 / 30  # seconds between progress bar repaints
+# pip name -> import name
+REQUIRED_PACKAGES = {
+    "pandas": "pandas",
+    "pikepdf": "pikepdf",
+    "openpyxl": "openpyxl",
+    "python-calamine": "python_calamine",
+    "pyarrow": "pyarrow",  # parquet engine for the mapping cache
+}
 
 # ---------------------------------------------------------------------
 # Python version check
@@ -36,10 +68,9 @@ if not REQUIREMENTS_FILE.exists():
 # Automatic installation of missing packages
 # ---------------------------------------------------------------------
 missing_modules = []
-for pkg in REQUIRED_PACKAGES:
-    try:
-        __import__(pkg)
-    except ModuleNotFoundError:
+for pkg, module in REQUIRED_PACKAGES.items():
+    # find_spec locates the package without importing it
+    if importlib.util.find_spec(module) is None:
         missing_modules.append(pkg)
 
 if missing_modules:
@@ -53,8 +84,11 @@ if missing_modules:
 # ---------------------------------------------------------------------
 # Imports after install
 # ---------------------------------------------------------------------
-import pandas as pd  # noqa: E402
-from PyPDF2 import PdfReader, PdfWriter  # noqa: E402
+# numpy, pandas and pikepdf are imported locally by the functions that use
+# them, so early exits skip their import cost; these are for type hints only
+if TYPE_CHECKING:
+    import pandas as pd
+    import pikepdf
 
 # ---------------------------------------------------------------------
 # ANSI colors
@@ -75,10 +109,6 @@ def print_error(message: str, help_lines: list[str]):
         print(f"{HELP}• {line}{RST}")
     print()
 
-def sanitize_filename(value: str) -> str:
-    cleaned = re.sub(r'[\/:*?"<>|\s]+', '_', value.strip())
-    return cleaned.strip('_').lower()
-
 def ask_yes_no(prompt: str) -> bool:
     choice = input(prompt).strip().lower()
     if choice not in {"y", "n"}:
@@ -86,15 +116,21 @@ def ask_yes_no(prompt: str) -> bool:
         sys.exit(1)
     return choice == "y"
 
+def print_progress(done: int, total: int):
+    progress = done / total
+    bar = "█" * int(30 * progress) + "-" * (30 - int(30 * progress))
+    print(f"\r{INFO}|{bar}| {done}/{total}{RST}", end="")
+
 def check_pdf_files(base_dir: Path) -> Path:
-    pdfs = list(base_dir.glob("*.pdf"))
+    with os.scandir(base_dir) as entries:
+        pdfs = [e.name for e in entries if e.name.lower().endswith(".pdf") and e.is_file()]
     if len(pdfs) != 1:
         print_error(
             "Expected exactly one PDF file.",
             ["Place only one .pdf file in the script directory"]
         )
         sys.exit(1)
-    return pdfs[0]
+    return base_dir / pdfs[0]
 
 def create_output_folder(base_dir: Path, pdf_path: Path) -> Path:
     folder = base_dir / pdf_path.stem
@@ -105,13 +141,26 @@ def create_output_folder(base_dir: Path, pdf_path: Path) -> Path:
 # ---------------------------------------------------------------------
 # Excel auto-detection & renaming
 # ---------------------------------------------------------------------
+@lru_cache(maxsize=None)
+def excel_engine() -> Optional[str]:
+    # calamine needs pandas 2.2+ and python-calamine; None lets pandas pick openpyxl
+    major, minor = (int(p) for p in re.findall(r"\d+", importlib.metadata.version("pandas"))[:2])
+    if (major, minor) >= (2, 2) and importlib.util.find_spec("python_calamine") is not None:
+        return EXCEL_ENGINE
+    return None
+
+def read_excel(path: Path, **kwargs) -> pd.DataFrame:
+    import pandas as pd
+
+    return pd.read_excel(path, engine=excel_engine(), **kwargs)
+
 def find_and_rename_valid_excel(target_path: Path) -> bool:
     candidates = [p for p in target_path.parent.glob("*.xlsx") if p != target_path]
     valid_files = []
 
     for excel in candidates:
         try:
-            df = pd.read_excel(excel, nrows=0)
+            df = read_excel(excel, nrows=0)
             if set(REQUIRED_COLUMNS).issubset(df.columns):
                 valid_files.append(excel)
         except Exception:
@@ -134,39 +183,80 @@ def find_and_rename_valid_excel(target_path: Path) -> bool:
 
     return False
 
-def load_excel(path: Path) -> pd.DataFrame:
-    if not path.exists():
-        renamed = find_and_rename_valid_excel(path)
+# ---------------------------------------------------------------------
+# Mapping loading & caching
+# ---------------------------------------------------------------------
+def mapping_cache_path(source: Path) -> Path:
+    # Keyed on the exact mtime and size: a replaced mapping may carry an older mtime
+    stat = source.stat()
+    return source.parent / f".{source.name}.{stat.st_mtime_ns}-{stat.st_size}.parquet"
+
+def read_mapping_cache(source: Path) -> Optional[pd.DataFrame]:
+    import pandas as pd
+
+    cache = mapping_cache_path(source)
+    if not cache.exists():
+        return None
+    try:
+        return pd.read_parquet(cache)
+    except Exception:
+        # Missing parquet engine or unreadable cache: parse the source again
+        return None
+
+def write_mapping_cache(source: Path, df: pd.DataFrame):
+    for stale in source.parent.glob(f".{source.name}.*.parquet"):
+        try:
+            stale.unlink()
+        except OSError:
+            continue  # harmless: a stale cache never matches the new fingerprint
+
+    try:
+        df.to_parquet(mapping_cache_path(source), index=False)
+    except Exception as e:
+        print(f"{WARN}Mapping cache not written ({e}); the mapping will be parsed again next run{RST}")
+
+def load_mapping(excel_path: Path, csv_path: Path) -> pd.DataFrame:
+    import pandas as pd
+
+    source = csv_path if csv_path.exists() else excel_path
+
+    if not source.exists():
+        renamed = find_and_rename_valid_excel(source)
         if not renamed:
-            pd.DataFrame(columns=REQUIRED_COLUMNS).to_excel(path, index=False)
+            pd.DataFrame(columns=REQUIRED_COLUMNS).to_excel(source, index=False)
             print_error(
-                f"Excel file '{path.name}' was created.",
+                f"Excel file '{source.name}' was created.",
                 ["Fill it with data and run the script again"]
             )
             sys.exit(0)
 
-    df = pd.read_excel(
-        path,
-        dtype={
-            "yearbook": "string",
-            "year": "string",
-            "category": "string",
-            "products": "string",
-            "yearbook_start": "Int64",
-            "yearbook_end": "Int64",
-            "pdf_start": "Int64",
-            "pdf_end": "Int64",
-        }
-    )
+    if source == csv_path and excel_path.exists():
+        print(f"{INFO}Using mapping file '{source.name}' (takes precedence over '{excel_path.name}'){RST}")
+    else:
+        print(f"{INFO}Using mapping file '{source.name}'{RST}")
+
+    df = read_mapping_cache(source)
+    cached = df is not None
+    if cached:
+        print(f"{INFO}Loaded cached mapping for '{source.name}'{RST}")
+
+    if not cached:
+        if source.suffix == ".csv":
+            df = pd.read_csv(source, dtype=COLUMN_DTYPES)
+        else:
+            df = read_excel(source, dtype=COLUMN_DTYPES)
 
     missing = set(REQUIRED_COLUMNS) - set(df.columns)
     if missing or df.empty:
         print_error(
-            "Excel validation failed.",
+            f"Mapping file '{source.name}' validation failed.",
             ["Verify required columns exist", "Ensure the file is not empty"]
         )
         sys.exit(1)
 
+    if not cached:
+        write_mapping_cache(source, df)
+
     return df
 
 # ---------------------------------------------------------------------
@@ -188,31 +278,105 @@ def handle_empty_products(df: pd.DataFrame) -> pd.DataFrame:
     df.loc[empty, "products"] = ""
     return df
 
-def generate_output_name(row) -> str:
-    data = {field: sanitize_filename(str(getattr(row, field))) for field in FIELDS_TO_SANITIZE}
-
-    if data["products"] == "":
-        return f"{data['yearbook']}_{data['category']}_{data['year']}_{int(row.yearbook_start)}_{int(row.yearbook_end)}"
+def sanitize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    for field in FIELDS_TO_SANITIZE:
+        df[field] = (
+            df[field].astype(str).str.strip()
+            .str.replace(SANITIZE_PATTERN, "_", regex=True)
+            .str.strip("_").str.lower()
+        )
+    return df
 
-    return OUTPUT_PATTERN.format(
-        yearbook=data["yearbook"],
-        category=data["category"],
-        year=data["year"],
-        first_page=int(row.yearbook_start),
-        last_page=int(row.yearbook_end),
-        product=data["products"]
+def generate_output_names(df: pd.DataFrame) -> pd.Series:
+    # Expects sanitized fields; the product segment is omitted when empty
+    base = df["yearbook"].str.cat(
+        [df["category"], df["year"], df["yearbook_start"].astype(str), df["yearbook_end"].astype(str)],
+        sep="_"
+    )
+    return base.where(df["products"] == "", base.str.cat(df["products"], sep="_"))
+
+def validate_rows(df: pd.DataFrame, total_pages: int):
+    import numpy as np
+
+    # Every row is checked in one pass; only the first failing row is reported
+    complete = df[[c for c in REQUIRED_COLUMNS if c != "products"]].notna().all(axis=1).to_numpy()
+    book_first, book_last, pdf_first, pdf_last = df[PAGE_COLUMNS].fillna(0).to_numpy(np.int64).T
+    valid = (
+        complete
+        & (pdf_first >= 1) & (pdf_last <= total_pages) & (pdf_first <= pdf_last)
+        & (book_first <= book_last)
     )
+    if valid.all():
+        return
 
-def unique_output_path(folder: Path, name: str) -> Path:
-    candidates = (folder / f"{name}.pdf", *(folder / f"{name}_{i}.pdf" for i in range(1, 10_000)))
-    return next(p for p in candidates if not p.exists())
+    i = int(np.argmin(valid))
+    if not complete[i]:
+        print_error(f"Missing values in row {i + 1}.", ["Fill every column except 'products'"])
+    else:
+        print_error(
+            f"Invalid page range in row {i + 1}.",
+            ["Check pdf_start and pdf_end values", "yearbook_start must not exceed yearbook_end"]
+        )
+    sys.exit(1)
 
-def extract_pdf_pages(reader: PdfReader, start: int, end: int, output: Path):
-    writer = PdfWriter()
-    for i in range(start - 1, end):
-        writer.add_page(reader.pages[i])
-    with open(output, "wb") as f:
-        writer.write(f)
+def unique_output_path(folder: Path, name: str, conflicts: set[str], reserved: set[str]) -> Path:
+    # conflicts and reserved hold lowercased names, matching case-insensitive file systems
+    candidates = (f"{name}_{i}.pdf" if i else f"{name}.pdf" for i in range(10_000))
+    return folder / next(
+        c for c in candidates if c.lower() not in conflicts and c.lower() not in reserved
+    )
+
+def write_file(path: Path, data: memoryview):
+    # One os.write per chunk the OS accepts, instead of a buffered file object's small writes
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    fd = os.open(path, flags, 0o666)  # umask applies, as with open()
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
+# Source PDF opened once per worker process by init_worker
+worker_pdf: Optional[pikepdf.Pdf] = None
+
+def init_worker(pdf_bytes: bytes):
+    # pikepdf.Pdf objects do not pickle, so each worker parses its own copy from memory
+    global worker_pdf
+    import pikepdf
+
+    worker_pdf = pikepdf.Pdf.open(io.BytesIO(pdf_bytes))
+
+def extract_pdf_pages(task: tuple[int, int, list[Path]]) -> int:
+    # Builds the page range once and writes the same bytes to every output sharing it
+    import pikepdf
+
+    start, end, outputs = task
+    buffer = io.BytesIO()
+    with pikepdf.Pdf.new() as dst_pdf:
+        dst_pdf.pages.extend(worker_pdf.pages[start - 1:end])
+        dst_pdf.save(buffer, linearize=False, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    data = buffer.getbuffer()
+    for output in outputs:
+        write_file(output, data)
+    return len(outputs)
+
+def extract_pdf_pages_qpdf(qpdf: str, pdf_path: Path, task: tuple[int, int, list[Path]]) -> int:
+    # Runs in a thread: the page copy itself happens in the qpdf child process
+    start, end, outputs = task
+    first, *copies = outputs
+    result = subprocess.run(
+        [qpdf, "--empty", "--object-streams=generate",
+         "--pages", str(pdf_path), f"{start}-{end}", "--", str(first)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    if result.returncode not in (0, 3):  # 3: succeeded with warnings
+        raise RuntimeError(
+            f"qpdf failed on pages {start}-{end} (exit {result.returncode}): "
+            f"{result.stderr.decode(errors='replace').strip()}"
+        )
+    for copy in copies:
+        shutil.copyfile(first, copy)
+    return len(outputs)
 
 # ---------------------------------------------------------------------
 # Main
@@ -223,15 +387,29 @@ def split_and_rename_pdf():
     pdf_path = check_pdf_files(BASE_DIR)
     output_folder = create_output_folder(BASE_DIR, pdf_path)
 
-    df = load_excel(EXCEL_FILENAME)
+    df = load_mapping(EXCEL_FILENAME, CSV_FILENAME)
+
+    import numpy as np
+    import pikepdf
+
+    # Only the process pool needs the source in memory; qpdf reads it from disk
+    qpdf = shutil.which("qpdf")
+    pdf_bytes = None if qpdf else pdf_path.read_bytes()
+    with pikepdf.Pdf.open(pdf_path if qpdf else io.BytesIO(pdf_bytes)) as src_pdf:
+        total_pages = len(src_pdf.pages)
+
+    validate_rows(df, total_pages)
     df = handle_empty_products(df)
+    df = sanitize_columns(df)
 
-    reader = PdfReader(pdf_path)
-    total_pages = len(reader.pages)
+    starts = df["pdf_start"].to_numpy(np.int64)
+    ends = df["pdf_end"].to_numpy(np.int64)
 
-    df["output_name"] = df.apply(generate_output_name, axis=1)
+    output_names = generate_output_names(df)
 
-    existing = df["output_name"].map(lambda n: (output_folder / f"{n}.pdf").exists())
+    # Lowercased so 'ABC.pdf' on disk still conflicts with 'abc.pdf' on Windows/macOS
+    existing_names = {n.lower() for n in os.listdir(output_folder)}
+    existing = (output_names + ".pdf").str.lower().isin(existing_names)
 
     overwrite_all = False
     if existing.any():
@@ -239,25 +417,48 @@ def split_and_rename_pdf():
             f"{WARN}{existing.sum()} files already exist. Overwrite all? (y/n): {RST}"
         )
 
-    total = len(df)
+    ranges: dict[tuple[int, int], list[Path]] = {}
+    reserved = set()
+
+    # Bound once outside the per-row loop; tolist() yields plain Python str/int values
+    conflicts = set() if overwrite_all else existing_names
+    reserve, add_range = reserved.add, ranges.setdefault
 
-    for idx, row in enumerate(df.itertuples(), start=1):
-        pdf_start, pdf_end = int(row.pdf_start), int(row.pdf_end)
+    for name, pdf_start, pdf_end in zip(output_names.tolist(), starts.tolist(), ends.tolist()):
+        filename = f"{name}.pdf"
+        key = filename.lower()
 
-        if pdf_start < 1 or pdf_end > total_pages or pdf_start > pdf_end:
-            print_error(f"Invalid page range in row {idx}.", ["Check pdf_start and pdf_end values"])
-            sys.exit(1)
+        if key in conflicts or key in reserved:
+            output_path = unique_output_path(output_folder, name, conflicts, reserved)
+        else:
+            output_path = output_folder / filename
 
-        output_path = output_folder / f"{row.output_name}.pdf"
+        reserve(output_path.name.lower())
+        add_range((pdf_start, pdf_end), []).append(output_path)
 
-        if output_path.exists() and not overwrite_all:
-            output_path = unique_output_path(output_folder, row.output_name)
+    tasks = [(start, end, outputs) for (start, end), outputs in ranges.items()]
+    total = len(df)
+    done = 0
+    last_draw = 0.0
+
+    if qpdf:
+        executor = ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 2)
+        worker = partial(extract_pdf_pages_qpdf, qpdf, pdf_path)
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=os.cpu_count(), initializer=init_worker, initargs=(pdf_bytes,)
+        )
+        worker = extract_pdf_pages
 
-        extract_pdf_pages(reader, pdf_start, pdf_end, output_path)
+    with executor:
+        for written in executor.map(worker, tasks):
+            done += written
+            now = time.monotonic()
+            if now - last_draw >= PROGRESS_INTERVAL:
+                last_draw = now
+                print_progress(done, total)
 
-        progress = idx / total
-        bar = "█" * int(30 * progress) + "-" * (30 - int(30 * progress))
-        print(f"\r{INFO}|{bar}| {idx}/{total}{RST}", end="")
+    print_progress(total, total)
 
     print(f"\n{OK}PDFs successfully created.{RST}")
 